@@ -5,10 +5,15 @@ const {StatsWriterPlugin} = require('webpack-stats-plugin');
 
 class AssetsMapWriterPlugin extends StatsWriterPlugin {
 
-    constructor(filename) {
-        super({fields: ['assets'], filename});
+    /**
+     * With `entrypoints` enabled the assets map is written as an object with the
+     * mapping under `assets` and the chunk files of each entrypoint under `entrypoints`.
+     */
+    constructor(filename, {entrypoints = false} = {}) {
+        super({fields: entrypoints ? ['assets', 'entrypoints'] : ['assets'], filename});
 
         this.mapping = {};
+        this.entrypoints = entrypoints;
 
         // @ts-ignore
         this.opts.transform = this.transform.bind(this);
@@ -29,6 +34,17 @@ class AssetsMapWriterPlugin extends StatsWriterPlugin {
             this.mapping[key] = name;
         });
 
+        if (this.entrypoints) {
+            const entrypoints = {};
+
+            Object.entries(stats.entrypoints || {}).forEach(([entrypoint, {assets}]) => {
+                /* webpack 4 lists the filenames, webpack 5 objects containing them */
+                entrypoints[entrypoint] = assets.map((asset) => (typeof asset === 'string' ? asset : asset.name));
+            });
+
+            return JSON.stringify({assets: this.mapping, entrypoints}, null, 2);
+        }
+
         return JSON.stringify(this.mapping, null, 2);
     }
 
@@ -1,14 +1,83 @@
+import datetime
+import decimal
+import re
+
 from pathlib import PurePath
 from uuid import UUID
 
 from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.duration import duration_iso_string
 from django.utils.functional import Promise
+from django.utils.timezone import is_aware
 
 try:
     from django.utils.encoding import force_str
 except ImportError:
     from django.utils.encoding import force_text as force_str
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+COMPACT_SEPARATORS = (',', ':')
+INDENT_SEPARATORS = (',', ': ')
+
+# the characters the json module escapes in addition when ensure_ascii is set
+NON_ASCII = re.compile(r'[^\x00-\x7e]')
+
+
+def convert_text(encoder, o):
+    return force_str(o)
+
+
+def convert_datetime(encoder, o):
+    # the same format as the django encoder, see "Date Time String Format" in ECMA-262
+    r = o.isoformat()
+
+    if o.microsecond:
+        r = r[:23] + r[26:]
+
+    if r.endswith('+00:00'):
+        r = r[:-6] + 'Z'
+
+    return r
+
+
+def convert_date(encoder, o):
+    return o.isoformat()
+
+
+def convert_time(encoder, o):
+    if is_aware(o):
+        raise ValueError("JSON can't represent timezone-aware times.")
+
+    r = o.isoformat()
+
+    return r[:12] if o.microsecond else r
+
+
+def convert_duration(encoder, o):
+    return duration_iso_string(o)
+
+
+def convert_decimal(encoder, o):
+    return str(o)
+
+
+def convert_default(encoder, o):
+    return super(AdvancedJSONEncoder, encoder).default(o)
+
+
+# the rules of the django encoder, looked up once per class instead of on every call
+DJANGO_CONVERTERS = (
+    (datetime.datetime, convert_datetime),
+    (datetime.date, convert_date),
+    (datetime.time, convert_time),
+    (datetime.timedelta, convert_duration),
+    (decimal.Decimal, convert_decimal),
+)
+
 
 class AdvancedJSONEncoder(DjangoJSONEncoder):
     """
@@ -23,12 +92,150 @@ class AdvancedJSONEncoder(DjangoJSONEncoder):
         UUID,
     )
 
+    # converters registered for classes of this encoder
+    converters = {}
+
+    # converters looked up per encoder and concrete class, shared by all encoders
+    dispatch = {}
+
     def default(self, o, texts=TEXT_TYPES):
         """
-        Converts exceptions and promises to strings.
+        Converts exceptions and promises to strings. The converter for each
+        class is looked up once and cached for all of its instances.
         """
 
-        if isinstance(o, texts):
-            return force_str(o)
+        if texts is not AdvancedJSONEncoder.TEXT_TYPES:
+            return force_str(o) if isinstance(o, texts) else super(AdvancedJSONEncoder, self).default(o)
+
+        key = self.__class__, o.__class__
+
+        try:
+            converter = self.dispatch[key]
+        except KeyError:
+            converter = self.dispatch[key] = self.get_converter(o.__class__)
+
+        return converter(self, o)
+
+    @classmethod
+    def register(cls, klass, converter=None):
+        """
+        Registers a converter for instances of the given class and its subclasses on this encoder
+        and its subclasses. Could be used as a decorator. Like the default method, converters are
+        only called for objects the encoder could not encode natively.
+        """
+
+        if converter is None:
+            def inner(function):
+                cls.register(klass, function)
+                return function
+            return inner
+
+        if 'converters' not in vars(cls):
+            cls.converters = {}
+
+        cls.converters[klass] = converter
+        AdvancedJSONEncoder.dispatch.clear()
+
+        return converter
+
+    @classmethod
+    def get_converter(cls, klass):
+        """
+        Returns the converter for instances of the class. Registered converters take
+        precedence, followed by the text types and the rules of the django encoder.
+        """
+
+        converters = {}
+
+        for encoder in reversed(cls.__mro__):
+            converters.update(vars(encoder).get('converters', {}))
+
+        for base in klass.__mro__:
+            if base in converters:
+                converter = converters[base]
+
+                return lambda encoder, o: converter(o)
+
+        if issubclass(klass, cls.TEXT_TYPES):
+            return convert_text
+
+        for base, converter in DJANGO_CONVERTERS:
+            if issubclass(klass, base):
+                return converter
+
+        return convert_default
+
+
+def escape_non_ascii(match):
+    code = ord(match.group(0))
+
+    if code < 0x10000:
+        return '\\u{0:04x}'.format(code)
+
+    code -= 0x10000
+
+    return '\\u{0:04x}\\u{1:04x}'.format(0xd800 | (code >> 10), 0xdc00 | (code & 0x3ff))
+
+
+class FastJSONEncoder(AdvancedJSONEncoder):
+    """
+    Encodes with orjson when it is installed and falls back to the json module otherwise
+    or for input orjson does not support. Separators are compact when no indent is given,
+    since orjson only writes those. All types not native to JSON, including datetimes,
+    are still converted by the `default` method. Views opt in by setting it as their encoder.
+
+    The output differs from the json module for floats. Exponents are written as 1e16 and
+    1e-7 instead of 1e+16 and 1e-07, and small numbers like 0.00001 are not written with an
+    exponent at all. These parse to the same values. Non-finite floats are written as null,
+    where the json module writes NaN and Infinity, or raises a ValueError without allow_nan.
+    Members of plain enums are written as their value, since orjson encodes them natively,
+    where the json module calls `default`, which raises a TypeError unless a converter for the
+    enum is registered. Dictionaries with keys other than strings are encoded by the json module.
+    """
+
+    def __init__(self, *args, separators=None, **kwargs):
+        if separators is None and kwargs.get('indent') is None:
+            separators = COMPACT_SEPARATORS
+
+        super(FastJSONEncoder, self).__init__(*args, separators=separators, **kwargs)
+
+    def encode(self, o):
+        option = self.get_option()
+
+        if option is None:
+            return super(FastJSONEncoder, self).encode(o)
+
+        try:
+            content = orjson.dumps(o, default=self.default, option=option).decode('utf-8')
+        except TypeError:
+            # raises the error of the json module for unsupported input
+            return super(FastJSONEncoder, self).encode(o)
+
+        if self.ensure_ascii and not content.isascii():
+            return NON_ASCII.sub(escape_non_ascii, content)
+
+        return content
+
+    def get_option(self):
+        """
+        Returns the orjson option matching the configuration of the encoder or None if there is none.
+        """
+
+        if orjson is None or self.skipkeys:
+            return None
+
+        # without OPT_NON_STR_KEYS, as orjson would accept keys like dates the json module rejects
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        separators = self.item_separator, self.key_separator
+
+        if self.indent is None and separators == COMPACT_SEPARATORS:
+            pass
+        elif self.indent in (2, '  ') and separators == INDENT_SEPARATORS:
+            option |= orjson.OPT_INDENT_2
+        else:
+            return None
+
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
 
-        return super(AdvancedJSONEncoder, self).default(o)
+        return option
@@ -1,5 +1,8 @@
 from .now import now
+from .preload import add_preload, preload
 
 __all__ = [
+    'add_preload',
     'now',
+    'preload',
 ]
@@ -1,25 +1,279 @@
 import datetime
 
-from django.db import models
+from contextlib import ExitStack
+
+from django.db import connections, models, transaction
+from django.db.models import Q, prefetch_related_objects
 from django.utils import timezone
 from django.utils.timezone import localtime
 from django.utils.translation import gettext_lazy as _
 
+from cosmogo.models.fields.timestamp import ModifiedField
 from cosmogo.utils.migrations import disable_auto_now
 
 
+def get_auto_now_fields(model):
+    return [field for field in model._meta.concrete_fields if getattr(field, 'auto_now', False)]
+
+
 class UpdateQuerySet(models.QuerySet):
 
     def get_for_update(self, *, nowait=False, skip_locked=False, of=(), no_key=False, **kwargs):
         return self.select_for_update(nowait=nowait, skip_locked=skip_locked, of=of, no_key=no_key).get(**kwargs)
 
+    def claim(self, n, *, order_by=('pk',), mark=None, modified: datetime.datetime | bool = None, **filters):
+        """
+        Claims up to n rows matching the filters for the caller, marks them with the values of mark and
+        returns them. Rows are locked with SELECT ... FOR UPDATE SKIP LOCKED, so concurrent workers claim
+        distinct rows without waiting for each other. Databases without SKIP LOCKED, like SQLite, claim each
+        row with an update repeating the filters, so a row already marked by another worker is skipped.
+
+        Without mark the rows are only locked, which requires the caller to hold a transaction, as
+        the locks would be released on return and the next call would claim the same rows again.
+        """
+
+        if not mark and not transaction.get_connection(self.db).in_atomic_block:
+            raise ValueError('claim() requires mark or a transaction holding the locks of the claimed rows.')
+
+        if isinstance(order_by, str):
+            order_by = order_by,
+
+        values = {**(mark or {})}
+
+        if values and modified is not False:
+            modified = localtime(None) if modified in (None, True) else modified
+            values.update({field.name: modified for field in get_auto_now_fields(self.model)})
+
+        queryset = self.filter(**filters).order_by(*order_by)
+
+        with transaction.atomic(using=self.db):
+            if connections[self.db].features.has_select_for_update_skip_locked:
+                objs = [*queryset.select_for_update(skip_locked=True)[:n]]
+
+                if values and objs:
+                    self.filter(pk__in=[obj.pk for obj in objs]).update(**values)
+            else:
+                objs = [*queryset[:n]]
+
+                if values:
+                    objs = [obj for obj in objs if self.filter(pk=obj.pk, **filters).update(**values)]
+
+        for obj in objs:
+            for name, value in values.items():
+                setattr(obj, name, value)
+
+        return objs
+
+    def chunked(self, size, key='pk', *, prefetch=()):
+        """
+        Yields lists of up to size objects using keyset pagination, each chunk is fetched in a short transaction
+        of its own. The key is a field name or a tuple of them, like ('modified', 'pk'), prefixed with a minus for
+        descending order. The last field has to be unique and none of them nullable. The given related lookups
+        are prefetched for each chunk.
+        """
+
+        if isinstance(key, str):
+            key = key,
+
+        fields = []
+
+        for name in key:
+            descending = name.startswith('-')
+            name = name.lstrip('-')
+            attname = 'pk' if name == 'pk' else self.model._meta.get_field(name).attname
+            fields.append((attname, 'lt' if descending else 'gt'))
+
+        queryset = self.order_by(*key)
+        last = None
+
+        while True:
+            chunk = queryset
+
+            if last is not None:
+                # lexicographic comparison of the key with the last row, e.g. a > x OR (a = x AND b > y)
+                condition = Q()
+
+                for index, (attname, lookup) in enumerate(fields):
+                    equal = {attname: value for (attname, _), value in zip(fields[:index], last)}
+                    condition |= Q(**equal, **{f'{attname}__{lookup}': last[index]})
+
+                chunk = chunk.filter(condition)
+
+            with transaction.atomic(using=self.db):
+                objs = [*chunk[:size]]
+
+                if objs and prefetch:
+                    prefetch_related_objects(objs, *prefetch)
+
+            if not objs:
+                return
+
+            yield objs
+
+            if len(objs) < size:
+                return
+
+            last = [getattr(objs[-1], attname) for attname, _ in fields]
+
+    def touch(self, objs, fields, modified: datetime.datetime | bool = None):
+        """
+        Sets the auto now fields of all objects to the same timestamp, unless modified is false, and returns
+        the fields to save. Bulk operations skip `pre_save`, so the fields would not be updated otherwise.
+        """
+
+        fields = [*fields]
+
+        if modified is False:
+            return fields
+
+        if modified in (None, True):
+            modified = localtime(None)
+
+        for field in get_auto_now_fields(self.model):
+            for obj in objs:
+                setattr(obj, field.attname, modified)
+
+            if field.name not in fields:
+                fields.append(field.name)
+
+        return fields
+
+    def bulk_update_values(self, objs, fields, *, batch_size=None, modified: datetime.datetime | bool = None):
+        """
+        Updates the given fields of all objects with one query per batch and sets the modified timestamp
+        like `Timestamped.update` does.
+        """
+
+        objs = [*objs]
+        fields = self.touch(objs, fields, modified=modified)
+
+        return self.bulk_update(objs, fields, batch_size=batch_size)
+
+    def bulk_upsert(self, objs, unique_fields, update_fields, *, batch_size=None,
+                    modified: datetime.datetime | bool = None):
+        """
+        Inserts all objects and updates the given fields of existing rows conflicting on the unique fields
+        with one query per batch, using ON CONFLICT on PostgreSQL and SQLite. The modified timestamp is set
+        like `Timestamped.update` does, while the created timestamp of existing rows is kept.
+        """
+
+        objs = [*objs]
+        update_fields = self.touch(objs, update_fields, modified=modified)
+
+        with ExitStack() as stack:
+            if modified is not False:
+                # inserts would call `pre_save` and overwrite the timestamp for each object
+                for field in get_auto_now_fields(self.model):
+                    stack.enter_context(disable_auto_now(self.model, field))
+
+            return self.bulk_create(
+                objs,
+                batch_size=batch_size,
+                update_conflicts=True,
+                unique_fields=unique_fields,
+                update_fields=update_fields,
+            )
+
 
 class UpdateModel(models.Model):
     objects = UpdateQuerySet.as_manager()
 
+    # when enabled `save` only writes changed fields and skips the query if nothing changed
+    track_changes = False
+
     class Meta:
         abstract = True
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+
+        if cls.track_changes:
+            # references to the loaded values, they are replaced and not changed in place on assignment
+            instance._loaded_values = dict(zip(field_names, values))
+
+        return instance
+
+    def get_dirty_fields(self):
+        """
+        Returns the names of the concrete fields changed since the instance was loaded or saved.
+        Values mutated in place, like dictionaries of a JSON field, are not detected.
+        """
+
+        fields = [field for field in self._meta.concrete_fields if not field.primary_key]
+        loaded = getattr(self, '_loaded_values', None)
+
+        if not self.is_tracked():
+            return [field.name for field in fields]
+
+        return [
+            field.name for field in fields
+            if field.attname in self.__dict__ and (
+                field.attname not in loaded or loaded[field.attname] != self.__dict__[field.attname]
+            )
+        ]
+
+    def is_dirty(self):
+        return bool(self.get_dirty_fields())
+
+    def is_tracked(self):
+        """
+        Returns whether the instance is saved as the row it was loaded from, which is
+        not the case for new instances or when the primary key was reset or changed.
+        """
+
+        loaded = getattr(self, '_loaded_values', None)
+
+        if loaded is None or self._state.adding or self.pk is None:
+            return False
+
+        return loaded.get(self._meta.pk.attname) == self.pk
+
+    def save(self, *args, **kwargs):
+        tracking = self.track_changes and not args and self.is_tracked()
+
+        if tracking and not (kwargs.get('force_insert') or kwargs.get('update_fields')):
+            dirty = self.get_dirty_fields()
+
+            if not dirty:
+                return None
+
+            kwargs['update_fields'] = [*dirty, *[
+                field.name for field in get_auto_now_fields(self.__class__) if field.name not in dirty
+            ]]
+
+        result = super().save(*args, **kwargs)
+
+        if self.track_changes:
+            self.set_loaded_values(kwargs.get('update_fields'))
+
+        return result
+
+    def refresh_from_db(self, *args, **kwargs):
+        result = super().refresh_from_db(*args, **kwargs)
+
+        if self.track_changes:
+            self.set_loaded_values(kwargs.get('fields', args[1] if len(args) > 1 else None))
+
+        return result
+
+    def set_loaded_values(self, fields=None):
+        """
+        Marks the given fields or all loaded fields as unchanged.
+        """
+
+        loaded = getattr(self, '_loaded_values', None)
+
+        if fields is None or loaded is None:
+            loaded = self._loaded_values = {}
+            fields = [field.attname for field in self._meta.concrete_fields]
+        else:
+            fields = [self._meta.get_field(field).attname for field in fields]
+
+        for attname in fields:
+            if attname in self.__dict__:
+                loaded[attname] = self.__dict__[attname]
+
     def update(self, *, using=None, **values):
         for field, value in values.items():
             setattr(self, field, value)
@@ -29,7 +283,7 @@ class UpdateModel(models.Model):
 
 class Timestamped(UpdateModel):
     created = models.DateTimeField(_('created'), default=timezone.now, editable=False)
-    modified = models.DateTimeField(_('modified'), auto_now=True)
+    modified = ModifiedField(_('modified'), auto_now=True)
 
     TIMESTAMP_FIELDS = [
         'created',
@@ -1,9 +1,13 @@
 from .choice import ChoiceField, get_values
 from .citext import CICharField, CIEmailField
+from .timestamp import ContextAutoNowMixin, ModifiedField, disable_context_auto_now
 
 __all__ = [
     'ChoiceField',
     'CICharField',
     'CIEmailField',
+    'ContextAutoNowMixin',
+    'ModifiedField',
+    'disable_context_auto_now',
     'get_values',
 ]
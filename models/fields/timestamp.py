@@ -0,0 +1,40 @@
+"""
+Fields whose automatic timestamps could be disabled for the current thread or task only. Changing
+`auto_now` on the field instead affects concurrent saves of other instances of the same model.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db.models import DateTimeField
+
+disabled_auto_now = ContextVar('disabled_auto_now', default=frozenset())
+
+
+class ContextAutoNowMixin:
+
+    def pre_save(self, model_instance, add):
+        if self in disabled_auto_now.get():
+            # the behaviour of the field without auto_now and auto_now_add
+            return getattr(model_instance, self.attname)
+
+        return super().pre_save(model_instance, add)
+
+
+class ModifiedField(ContextAutoNowMixin, DateTimeField):
+
+    def deconstruct(self):
+        # migrations should not notice the difference to a regular date time field
+        name, path, args, kwargs = super().deconstruct()
+
+        return name, 'django.db.models.DateTimeField', args, kwargs
+
+
+@contextmanager
+def disable_context_auto_now(*fields):
+    token = disabled_auto_now.set(disabled_auto_now.get() | {*fields})
+
+    try:
+        yield
+    finally:
+        disabled_auto_now.reset(token)
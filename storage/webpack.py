@@ -1,6 +1,34 @@
+import gzip
+import os
+
 from django.contrib.staticfiles.storage import StaticFilesStorage
 
-from cosmogo.utils.webpack import get_asset
+from cosmogo.utils.http import ENCODINGS
+from cosmogo.utils.webpack import get_manifest
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+UNBUILT = object()
+
+COMPRESSORS = {
+    'br': brotli and brotli.compress,
+    'gzip': lambda content: gzip.compress(content, compresslevel=9, mtime=0),
+}
+
+COMPRESSIBLE_EXTENSIONS = (
+    '.css',
+    '.html',
+    '.js',
+    '.json',
+    '.map',
+    '.mjs',
+    '.svg',
+    '.txt',
+    '.xml',
+)
 
 
 class WebPackStorage(StaticFilesStorage):
@@ -9,12 +37,114 @@ class WebPackStorage(StaticFilesStorage):
     assets to their hash named url's.
     """
 
+    compress_min_size = 1024
+
+    def __init__(self, *args, **kwargs):
+        super(WebPackStorage, self).__init__(*args, **kwargs)
+
+        self.table = UNBUILT, {}
+
     def url(self, name):
         """
         Try to look up the name in the webpack asset mapping
         and return the url containing the current hash.
         """
 
-        name = get_asset(name) or name
+        table = self.get_table()
+
+        try:
+            return table[name]
+        except KeyError:
+            url = table[name] = super(WebPackStorage, self).url(name)
+
+        return url
+
+    def urls(self, names):
+        """
+        Returns the urls for all given names.
+        """
+
+        table = self.get_table()
+
+        return [table[name] if name in table else self.url(name) for name in names]
+
+    def get_table(self):
+        """
+        Returns the final urls of all mapped assets. The table is rebuilt when the mapping changed,
+        urls of names without a mapping are added to it as soon as they are requested.
+        """
+
+        version, mapping, _, _ = get_manifest().get_state()
+        current, table = self.table
+
+        if current != version:
+            url = super(WebPackStorage, self).url
+            table = {name: url(asset) for name, asset in mapping.items()}
+            self.table = version, table
+
+        return table
+
+    def post_process(self, paths, dry_run=False, **options):
+        """
+        Writes brotli and gzip compressed variants next to compressible assets, so they could be
+        served precompressed. Variants newer than their asset are kept as they are.
+        """
+
+        if dry_run:
+            return
+
+        for name in paths:
+            if not name.endswith(COMPRESSIBLE_EXTENSIONS):
+                continue
+
+            filepath = self.path(name)
+
+            try:
+                stat = os.stat(filepath)
+            except FileNotFoundError:
+                continue
+
+            if stat.st_size < self.compress_min_size:
+                continue
+
+            compressed = [self.compress(filepath, stat, encoding, suffix) for encoding, suffix in ENCODINGS]
+
+            yield name, name, any(compressed)
+
+    @staticmethod
+    def compress(filepath, stat, encoding, suffix):
+        compress = COMPRESSORS.get(encoding)
+        variant = f'{filepath}{suffix}'
+
+        if compress is None:
+            return False
+
+        try:
+            if os.stat(variant).st_mtime_ns >= stat.st_mtime_ns:
+                return False
+        except FileNotFoundError:
+            pass
+
+        with open(filepath, 'rb') as fp:
+            content = compress(fp.read())
+
+        if len(content) >= stat.st_size:
+            # a variant of an older version of the file must not be served
+            if os.path.exists(variant):
+                os.remove(variant)
+
+            return False
+
+        temporary = f'{variant}.tmp'
+
+        with open(temporary, 'wb') as fp:
+            fp.write(content)
+
+        os.replace(temporary, variant)
+
+        return True
+
+    def _clear_cached_properties(self, setting, **kwargs):
+        super(WebPackStorage, self)._clear_cached_properties(setting, **kwargs)
 
-        return super(WebPackStorage, self).url(name)
+        self.table = UNBUILT, {}
@@ -1,11 +1,16 @@
+import os
+
 from pathlib import Path
 
 from celery.app import shared_task
+from celery.utils.time import get_exponential_backoff_interval
 
 from django.conf import settings
+from django.core.cache import cache
 from django.core.management import call_command as django_call_command
 
 DEFAULT_CELERY_MONITORING_FILEPATH = Path(settings.BASE_DIR) / 'celery.check'
+RENDER_PDF_LOCK = 'cosmogo.render-pdf:%s'
 
 
 @shared_task(name='call-command')
@@ -21,6 +26,82 @@ def monitoring(task, filepath=None):
         fp.write(task.request.id)
 
 
+@shared_task(bind=True, name='render-pdf')
+def render_pdf(task, template, context, filepath, style=None, **options):
+    """
+    Renders the document into a temporary file next to the filepath and moves it into place when finished,
+    so an existing filepath always means a finished document. Releases the lock of the job afterwards.
+    """
+
+    from cosmogo.utils.pdf import render
+
+    temporary = f'{filepath}.{task.request.id}.tmp'
+
+    try:
+        render(template, context, style=style, target=temporary, **options)
+        os.replace(temporary, filepath)
+    finally:
+        cache.delete(RENDER_PDF_LOCK % task.request.id)
+
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+    return filepath
+
+
+@shared_task(name='remove-outdated-pdfs')
+def remove_outdated_pdfs(delta=None):
+    """
+    Removes the documents handed to nginx by `get_pdf_response` and the finished
+    documents of `RenderPDFJobMixIn`, should be scheduled periodically.
+    """
+
+    from cosmogo.utils.pdfresponse import remove_outdated_documents
+
+    return remove_outdated_documents(delta) + remove_outdated_documents(delta, get_job_root())
+
+
+@shared_task(
+    bind=True,
+    name='send-mail',
+    rate_limit=getattr(settings, 'MAIL_QUEUE_RATE_LIMIT', None),
+    max_retries=getattr(settings, 'MAIL_QUEUE_MAX_RETRIES', 8),
+)
+def send_queued_mail(task, payload, fail_silently=False):
+    """
+    Sends a mail serialized by `cosmogo.utils.mail.serialize_mail` over a connection reused between tasks.
+    Temporary failures are retried with exponential backoff, permanent ones like refused recipients are not.
+    Celery limits the rate as a token bucket.
+    """
+
+    from cosmogo.utils.mail import deserialize_mail, is_temporary, reset_queue_connection, send_queued
+
+    try:
+        return send_queued(deserialize_mail(payload))
+    except Exception as error:
+        # the connection may be broken, the retry should open a new one
+        reset_queue_connection()
+
+        if is_temporary(error) and task.request.retries < task.max_retries:
+            countdown = get_exponential_backoff_interval(
+                factor=getattr(settings, 'MAIL_QUEUE_RETRY_BACKOFF', 30),
+                retries=task.request.retries,
+                maximum=getattr(settings, 'MAIL_QUEUE_RETRY_BACKOFF_MAX', 60 * 60),
+                full_jitter=True,
+            )
+
+            raise task.retry(exc=error, countdown=countdown)
+
+        if fail_silently:
+            return 0
+
+        raise
+
+
+def get_job_root():
+    return getattr(settings, 'PDF_JOB_ROOT', None) or os.path.join(settings.BASE_DIR, 'pdf-jobs')
+
+
 def get_monitoring_filepath(task, filepath=None, default=DEFAULT_CELERY_MONITORING_FILEPATH):
     if filepath is None:
         filepath = getattr(settings, f'{task.app.namespace}_MONITORING_FILEPATH', default)
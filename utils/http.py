@@ -1,5 +1,7 @@
+import os
+
 from calendar import timegm
-from typing import Optional
+from typing import Optional, Tuple
 
 from django.http.response import HttpResponseBase
 
@@ -17,14 +19,97 @@ except ImportError:
             return disposition
 
 
+# precompressed variants in order of preference
+ENCODINGS = (
+    ('br', '.br'),
+    ('gzip', '.gz'),
+)
+
+
 def last_modified(filepath: FilePath) -> Optional[int]:
     if timestamp := get_last_modified(filepath):
         return timegm(timestamp.utctimetuple())
 
 
+def get_etag(filepath: FilePath) -> Optional[str]:
+    """
+    Returns an ETag derived from the modification time and the size of the file,
+    formatted like the ones nginx generates for static files.
+    """
+
+    try:
+        stat = os.stat(filepath)
+    except FileNotFoundError:
+        return None
+
+    return '"%x-%x"' % (int(stat.st_mtime), stat.st_size)
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Returns the first and last byte position of a single byte range header. Returns None when the
+    header should be ignored and raises a ValueError when the range is not satisfiable.
+    """
+
+    if not header or not header.startswith('bytes=') or ',' in header:
+        # multiple ranges are answered with the whole file
+        return None
+
+    first, separator, last = header[6:].strip().partition('-')
+
+    if not separator:
+        return None
+
+    try:
+        if first:
+            start = int(first)
+
+            if last and int(last) < start:
+                # syntactically invalid according to RFC 9110, so the header is ignored
+                return None
+
+            end = min(int(last), size - 1) if last else size - 1
+        else:
+            start = max(size - int(last), 0)
+            end = size - 1
+    except ValueError:
+        return None
+
+    if start < 0 or start > end:
+        raise ValueError(f'Range {header} is not satisfiable for {size} bytes.')
+
+    return start, end
+
+
 def add_content_disposition_header(response: HttpResponseBase, filename: str = None,
                                    as_attachment: bool = True) -> Optional[str]:
     if header := get_content_disposition_header(as_attachment, filename):
         response['Content-Disposition'] = header
 
     return header
+
+
+def get_accepted_encodings(header: Optional[str]) -> set:
+    """
+    Returns the content codings of an Accept-Encoding header that are not refused with a quality of zero.
+    """
+
+    encodings = set()
+
+    for token in (header or '').split(','):
+        coding, *params = [str.strip(bit) for bit in token.split(';')]
+        quality = 1.0
+
+        for param in params:
+            name, _, value = param.partition('=')
+
+            if str.strip(name) == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+
+        if coding and quality > 0:
+            encodings.add(coding.lower())
+
+    return encodings
@@ -1,7 +1,22 @@
-from functools import partial
+import threading
+import time
 
-from django.core.mail import send_mail as django_send_mail
-from django.template.loader import render_to_string
+from dataclasses import dataclass, field
+from itertools import islice
+from smtplib import SMTPException, SMTPRecipientsRefused, SMTPResponseException, SMTPServerDisconnected
+from typing import List, Optional
+
+from django.conf import settings
+
+from django.core.mail import EmailMultiAlternatives, get_connection, send_mail as django_send_mail
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.template.base import Node, TextNode
+from django.template.defaulttags import LoadNode
+from django.template.loader import get_template
+from django.templatetags.i18n import TranslateNode
+from django.utils.autoreload import file_changed
+from django.utils.translation import get_language
 
 EXTENSIONS = (
     'subject',
@@ -9,10 +24,44 @@ EXTENSIONS = (
     'html',
 )
 
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_QUEUE_CONNECTION_MAX_IDLE = 60
+
+MAIL_ATTRIBUTES = (
+    'subject',
+    'body',
+    'from_email',
+    'to',
+    'cc',
+    'bcc',
+    'reply_to',
+    'extra_headers',
+    'alternatives',
+)
+
+
+def send_mail(identifier, *recipients, request=None, options=None, context, queue=False):
+    """
+    Renders and sends the mail. With queue the rendered mail is sent by a celery task and its result is returned.
+    Queued mails accept the same options, except for a connection or credentials which could not be serialized.
+    """
 
-def send_mail(identifier, *recipients, request=None, options=None, context):
     subject, plain, html = render_mail(identifier, request=request, context=context)
 
+    if queue:
+        from cosmogo.tasks import send_queued_mail
+
+        options = dict(options or {})
+        fail_silently = options.pop('fail_silently', False)
+        recipients = options.pop('recipient_list', recipients)
+
+        assert not {'connection', 'auth_user', 'auth_password'} & {*options}, \
+            'Mails with their own connection could not be queued.'
+
+        mail = build_mail(subject, plain, html, recipients, options=options)
+
+        return send_queued_mail.delay(serialize_mail(mail), fail_silently=fail_silently)
+
     defaults = {
         'from_email': None,
         'subject': subject,
@@ -27,11 +76,286 @@ def send_mail(identifier, *recipients, request=None, options=None, context):
     return django_send_mail(**defaults)
 
 
-def render_mail(identifier, *, request=None, context):
-    render = partial(render_to_string, context=context, request=request)
-    subject, plain, html = [render(f'mails/{identifier}.{extension}') for extension in EXTENSIONS]
+@dataclass
+class MailBatchReport:
+    index: int
+    recipients: List[List[str]] = field(default_factory=list)
+    sent: int = 0
+    error: Optional[Exception] = None
+
+    @property
+    def failed(self):
+        return self.error is not None
+
+
+def send_mass_mail(identifier, messages, *, request=None, options=None, batch_size=DEFAULT_BATCH_SIZE,
+                   connection=None) -> List[MailBatchReport]:
+    """
+    Sends the mail to many recipients with their own context each. The messages are an iterable of
+    recipient lists and context pairs. The templates are resolved once and all batches are sent
+    over the same connection. Returns a report per batch instead of raising on failures.
+
+    The messages of a batch are sent one by one and the first `sent` of them were delivered when
+    the batch failed, so only the remaining ones have to be retried. The connection is opened for
+    each batch when it is not open yet and closed after a failure, so an unreachable server fails
+    the batches one by one and a broken connection does not fail the following batches. Only
+    connections opened here are closed afterwards, an open connection passed in stays open
+    unless it failed.
+    """
+
+    templates = get_templates(identifier)
+    connection = connection or get_connection(fail_silently=False)
+    opened = False
+    reports = []
+
+    try:
+        for index, batch in enumerate(batched(messages, batch_size)):
+            report = MailBatchReport(index=index, recipients=[recipients for recipients, _ in batch])
+
+            try:
+                emails = []
+
+                for recipients, context in batch:
+                    parts = render_mail(identifier, request=request, context=context, templates=templates)
+                    emails.append(build_mail(*parts, recipients, options=options))
+
+                opened = connection.open() or opened
+
+                for email in emails:
+                    report.sent += connection.send_messages([email]) or 0
+            except Exception as error:
+                report.error = error
+                close_connection(connection)
+
+            reports.append(report)
+    finally:
+        if opened:
+            close_connection(connection)
+
+    return reports
+
+
+def close_connection(connection):
+    try:
+        connection.close()
+    except Exception:
+        # the connection is probably broken already
+        pass
+
+
+def build_mail(subject, plain, html, recipients, *, options=None) -> EmailMultiAlternatives:
+    """
+    Returns the rendered mail as a message, options override the rendered parts like for `send_mail`.
+    """
+
+    options = options or {}
+
+    mail = EmailMultiAlternatives(
+        subject=options.get('subject', subject),
+        body=options.get('message', plain),
+        from_email=options.get('from_email'),
+        to=[*recipients],
+        **{key: value for key, value in options.items() if key in ('bcc', 'cc', 'reply_to', 'headers')},
+    )
+
+    html = options.get('html_message', html)
+
+    if html:
+        mail.attach_alternative(html, 'text/html')
+
+    return mail
+
+
+def serialize_mail(mail: EmailMultiAlternatives) -> dict:
+    """
+    Returns the mail as a dictionary that could be serialized by celery. Attachments are not supported.
+    """
+
+    assert not mail.attachments, 'Mails with attachments could not be queued.'
+
+    payload = {attribute: getattr(mail, attribute, None) for attribute in MAIL_ATTRIBUTES}
+    payload['alternatives'] = [[content, mimetype] for content, mimetype in payload['alternatives'] or []]
+
+    return payload
+
+
+def deserialize_mail(payload: dict, connection=None) -> EmailMultiAlternatives:
+    payload = dict(payload)
+    alternatives = payload.pop('alternatives', None) or []
+
+    mail = EmailMultiAlternatives(connection=connection, headers=payload.pop('extra_headers', None), **payload)
+
+    for content, mimetype in alternatives:
+        mail.attach_alternative(content, mimetype)
+
+    return mail
+
+
+_local = threading.local()
+
+
+def get_queue_connection():
+    """
+    Returns a connection of the current thread that is kept open between queued mails. It is closed
+    and opened again when it was idle for longer than MAIL_QUEUE_CONNECTION_MAX_IDLE seconds,
+    since servers drop idle connections and django does not notice before sending.
+    """
+
+    connection = getattr(_local, 'connection', None)
+    now = time.monotonic()
+    max_idle = getattr(settings, 'MAIL_QUEUE_CONNECTION_MAX_IDLE', DEFAULT_QUEUE_CONNECTION_MAX_IDLE)
+
+    if connection is not None and now - _local.used > max_idle:
+        reset_queue_connection()
+        connection = None
+
+    if connection is None:
+        connection = _local.connection = get_connection(fail_silently=False)
+        connection.open()
+
+    _local.used = now
+
+    return connection
+
+
+def send_queued(mail: EmailMultiAlternatives) -> int:
+    """
+    Sends the mail over the queue connection and reconnects once when the server closed it.
+    """
+
+    try:
+        return get_queue_connection().send_messages([mail])
+    except SMTPServerDisconnected:
+        reset_queue_connection()
+
+    return get_queue_connection().send_messages([mail])
+
+
+def is_temporary(error: Exception) -> bool:
+    """
+    Returns whether sending could succeed later. Permanent 5xx replies, like refused recipients, are not.
+    """
+
+    if isinstance(error, SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+
+    if isinstance(error, SMTPResponseException):
+        return not 500 <= error.smtp_code < 600
+
+    if isinstance(error, SMTPException):
+        return isinstance(error, SMTPServerDisconnected)
+
+    return isinstance(error, OSError)
+
+
+def reset_queue_connection():
+    connection = getattr(_local, 'connection', None)
+    _local.connection = None
+
+    if connection is not None:
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+_templates = {}
+_subjects = {}
+
+
+def get_templates(identifier):
+    """
+    Returns the subject, plain and html templates of the mail. They are cached per
+    language, so projects using language aware template loaders are supported too.
+    """
+
+    language = get_language()
+    templates = []
+
+    for extension in EXTENSIONS:
+        key = identifier, extension, language
+
+        try:
+            template = _templates[key]
+        except KeyError:
+            template = _templates[key] = get_template(f'mails/{identifier}.{extension}')
+
+        templates.append(template)
+
+    return templates
+
+
+def render_mail(identifier, *, request=None, context, templates=None):
+    subject, plain, html = templates or get_templates(identifier)
+    subject = render_subject(identifier, subject, request=request, context=context)
+    plain, html = [template.render(context, request=request) for template in (plain, html)]
+
+    return subject, plain, html
+
+
+def render_subject(identifier, template, *, request=None, context):
+    """
+    Renders the subject and memoizes it per language when it does not depend on the context.
+    """
+
+    key = identifier, get_language()
+
+    try:
+        return _subjects[key]
+    except KeyError:
+        subject = clean_subject(template.render(context, request=request))
+
+    if identifier is not None and is_static(template):
+        _subjects[key] = subject
+
+    return subject
+
+
+def is_static(template):
+    """
+    Returns whether the django template only consists of text, loaded libraries and constant translations.
+    """
+
+    nodelist = getattr(getattr(template, 'template', None), 'nodelist', None)
+
+    if nodelist is None:
+        return False
+
+    for node in nodelist.get_nodes_by_type(Node):
+        if isinstance(node, (TextNode, LoadNode)):
+            continue
+
+        if isinstance(node, TranslateNode) and getattr(node.filter_expression.var, 'literal', None) is not None:
+            if not node.filter_expression.filters:
+                continue
+
+        return False
+
+    return True
+
+
+def clear_template_cache():
+    _templates.clear()
+    _subjects.clear()
+
+
+@receiver(file_changed)
+def clear_template_cache_on_change(sender, file_path, **kwargs):
+    if file_path.suffix.lstrip('.') in EXTENSIONS:
+        clear_template_cache()
+
 
-    return clean_subject(subject), plain, html
+@receiver(setting_changed)
+def clear_template_cache_on_setting_change(sender, setting, **kwargs):
+    if setting in ('TEMPLATES', 'LANGUAGE_CODE', 'LANGUAGES'):
+        clear_template_cache()
 
 
 def clean_subject(subject):
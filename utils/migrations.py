@@ -15,6 +15,15 @@ def disable_auto_now(model: Type[models.Model], field: Union[str, models.DateFie
 
     assert isinstance(field, models.DateField), f'{field.name} is no date field.'
 
+    from cosmogo.models.fields.timestamp import ContextAutoNowMixin, disable_context_auto_now
+
+    if isinstance(field, ContextAutoNowMixin):
+        # leaves the shared field untouched, so concurrent saves keep their timestamps
+        with disable_context_auto_now(field):
+            yield field.auto_now, field.auto_now_add
+
+        return
+
     auto_now, auto_now_add = field.auto_now, field.auto_now_add
     field.auto_now = field.auto_now_add = False
 
@@ -1,25 +1,148 @@
 from __future__ import annotations
 
+import base64
+import hashlib
+import hmac
+import mimetypes
 import os
 import posixpath
+import time
 
 from functools import lru_cache
 from typing import Type, Union
+from urllib.parse import quote
+
+from asgiref.sync import sync_to_async
 
 from django.conf import settings
-from django.http import HttpResponse, FileResponse
+from django.core.exceptions import ImproperlyConfigured
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, FileResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, parse_http_date_safe, urlencode
+
+from .http import ENCODINGS, get_accepted_encodings, get_etag, last_modified, parse_range
+
+DEFAULT_BLOCK_SIZE = 256 * 1024
+DEFAULT_SECURE_LINK_EXPRESSION = '{expires}{uri} {secret}'
+DEFAULT_SECURE_LINK_MAX_AGE = 60 * 60
+DEFAULT_SECURE_LINK_INTERVAL = 5 * 60
+
+
+def get_encoded_variant(filepath, request=None):
+    """
+    Returns the filepath of the best precompressed variant accepted by the request,
+    its content coding and whether variants of the file exist at all.
+    """
+
+    variants = [(encoding, f'{filepath}{suffix}') for encoding, suffix in ENCODINGS]
+    variants = [(encoding, variant) for encoding, variant in variants if os.path.exists(variant)]
+
+    if request is not None and variants:
+        accepted = get_accepted_encodings(request.headers.get('Accept-Encoding'))
+
+        for encoding, variant in variants:
+            if encoding in accepted or '*' in accepted:
+                return variant, encoding, True
+
+    return filepath, None, bool(variants)
+
+
+def get_content_type(filepath, content_type=''):
+    if content_type:
+        return content_type
+
+    mime_type, _ = mimetypes.guess_type(filepath)
+
+    return mime_type or 'application/octet-stream'
+
+
+def set_content_encoding(response, encoding, varies):
+    if encoding:
+        response['Content-Encoding'] = encoding
+
+    if varies:
+        patch_vary_headers(response, ['Accept-Encoding'])
+
+
+def set_validators(response, etag, modified):
+    if etag:
+        response['ETag'] = etag
+
+    if modified is not None:
+        response['Last-Modified'] = http_date(modified)
+
+
+def get_conditional_status(request, etag, modified):
+    """
+    Returns 304 or 412 when the conditional headers of the request ask for it, otherwise None.
+    """
+
+    if request is None:
+        return None
+
+    response = get_conditional_response(request, etag=etag, last_modified=modified)
+
+    return response and response.status_code
+
+
+class RangeFile:
+    """
+    File like object reading only the given byte range of a file. It has no file
+    descriptor on purpose, so servers could not send the whole file with sendfile.
+    """
+
+    def __init__(self, filepath, start, end):
+        self.fh = open(filepath, 'rb')
+        self.fh.seek(start)
+        self.remaining = end - start + 1
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+
+        data = self.fh.read(size)
+        self.remaining -= len(data)
+
+        return data
+
+    def close(self):
+        self.fh.close()
 
 
 class XAccelRedirect(HttpResponse):
+    """
+    Hands the file over to nginx. Precompressed variants have to be picked by nginx with `gzip_static`
+    or `brotli_static`, because it drops the Content-Encoding and Vary headers of the redirecting response.
+    """
+
     root: str
     location: str
+    cache_control = 'private, no-cache'
 
-    def __init__(self, filepath, *, as_attachment=False, filename=None, content_type=''):
+    def __init__(self, filepath, *, as_attachment=False, filename=None, content_type='', request=None):
         filename = filename or os.path.basename(filepath)
 
         super(XAccelRedirect, self).__init__(content_type=content_type)
 
-        self['X-Accel-Redirect'] = self.get_url(filepath)
+        if request is not None:
+            # validators match the ones nginx sends for the uncompressed
+            # file, so caches could revalidate against either of them
+            etag, modified = get_etag(filepath), last_modified(filepath)
+            status = get_conditional_status(request, etag, modified)
+
+            set_validators(self, etag, modified)
+
+            if self.cache_control:
+                self['Cache-Control'] = self.cache_control
+
+            if status:
+                self.status_code = status
+        else:
+            status = None
+
+        if not status:
+            self['X-Accel-Redirect'] = self.get_url(filepath)
 
         if as_attachment:
             self['Content-Disposition'] = f'attachment; filename="{filename}"'
@@ -42,15 +165,92 @@ class XAccelRedirect(HttpResponse):
 
 class DjangoFileResponse(FileResponse):
 
-    def __init__(self, filepath, **kwargs):
-        fh = open(filepath, 'rb')
+    def __init__(self, filepath, *, request=None, **kwargs):
+        variant, encoding, varies = get_encoded_variant(filepath, request)
+
+        if request is None:
+            super(DjangoFileResponse, self).__init__(open(variant, 'rb'), **kwargs)
+            set_content_encoding(self, encoding, varies)
+            return
+
+        # name and type of the original file, not of the compressed variant or a range of it
+        kwargs['filename'] = kwargs.get('filename') or os.path.basename(filepath)
+        kwargs['content_type'] = get_content_type(filepath, kwargs.get('content_type'))
+
+        size = os.path.getsize(variant)
+        etag, modified = get_etag(variant), last_modified(variant)
+        status = get_conditional_status(request, etag, modified)
+        byte_range = None
+
+        if not status and request.method == 'GET' and self.is_range_valid(request, etag, modified):
+            try:
+                byte_range = parse_range(request.headers.get('Range'), size)
+            except ValueError:
+                status = 416
+
+        if status:
+            super(DjangoFileResponse, self).__init__((), status=status, **kwargs)
+
+            if status == 416:
+                self['Content-Range'] = f'bytes */{size}'
+        elif byte_range:
+            start, end = byte_range
+
+            super(DjangoFileResponse, self).__init__(RangeFile(variant, start, end), status=206, **kwargs)
+
+            self['Content-Range'] = f'bytes {start}-{end}/{size}'
+            self['Content-Length'] = end - start + 1
+        else:
+            super(DjangoFileResponse, self).__init__(open(variant, 'rb'), **kwargs)
+
+        self['Accept-Ranges'] = 'bytes'
+        set_validators(self, etag, modified)
+        set_content_encoding(self, encoding, varies)
+
+    @staticmethod
+    def is_range_valid(request, etag, modified):
+        """
+        A range only applies when the If-Range header is missing or still matches the file.
+        """
+
+        if_range = request.headers.get('If-Range')
+
+        if not if_range:
+            return True
+
+        return if_range == etag or (modified is not None and parse_http_date_safe(if_range) == modified)
+
+
+class SendFileResponse(DjangoFileResponse):
+    """
+    File response for deployments without nginx. WSGI servers that offer a file wrapper could send
+    the file with `os.sendfile`, under ASGI the file is read asynchronously in large blocks.
+    """
+
+    block_size = getattr(settings, 'FILE_RESPONSE_BLOCK_SIZE', DEFAULT_BLOCK_SIZE)
+
+    def __init__(self, filepath, *, request=None, block_size=None, **kwargs):
+        block_size = self.block_size = block_size or self.block_size
+
+        super(SendFileResponse, self).__init__(filepath, request=request, **kwargs)
+
+        if isinstance(request, ASGIRequest) and self.file_to_stream is not None:
+            # the file is still closed by the closers registered for the original streaming content,
+            # the block size is bound here since the ASGI handler overwrites the one of the response
+            self.streaming_content = self.read_async(self.file_to_stream, block_size)
 
-        super(DjangoFileResponse, self).__init__(fh, **kwargs)
+    @staticmethod
+    async def read_async(filelike, block_size):
+        read = sync_to_async(filelike.read, thread_sensitive=False)
+
+        while chunk := await read(block_size):
+            yield chunk
 
 
 ResponseType = Union[
     Type[XAccelRedirect],
     Type[DjangoFileResponse],
+    Type[SendFileResponse],
 ]
 
 
@@ -58,4 +258,101 @@ def get_response_class(name, root=None, location='/') -> ResponseType:
     if settings.DEBUG:  # pragma: no cover
         return DjangoFileResponse
 
+    if not getattr(settings, 'USE_X_ACCEL_REDIRECT', True):
+        return SendFileResponse
+
     return XAccelRedirect.get_subclass(name, root or settings.BASE_DIR, location)
+
+
+def get_secure_link_secret(secret=None):
+    secret = secret or getattr(settings, 'SECURE_LINK_SECRET', None)
+
+    if not secret:
+        raise ImproperlyConfigured('Set SECURE_LINK_SECRET to the secret used in the secure_link_md5 of nginx.')
+
+    return secret
+
+
+def get_secure_link_hash(uri, expires, secret):
+    """
+    Returns the hash nginx computes with `secure_link_md5` for the configured expression,
+    by default `secure_link_md5 "$secure_link_expires$uri <secret>";`.
+    """
+
+    expression = getattr(settings, 'SECURE_LINK_EXPRESSION', DEFAULT_SECURE_LINK_EXPRESSION)
+    value = expression.format(expires=expires, uri=uri, secret=secret)
+    digest = hashlib.md5(value.encode('utf-8')).digest()
+
+    return base64.urlsafe_b64encode(digest).decode('ascii').rstrip('=')
+
+
+def get_secure_link_expires(max_age=DEFAULT_SECURE_LINK_MAX_AGE, interval=DEFAULT_SECURE_LINK_INTERVAL, now=None):
+    """
+    Returns the expiry timestamp rounded up to the interval, so links
+    signed within the same interval are equal and could be cached.
+    """
+
+    expires = int(now or time.time()) + max_age
+
+    return -(-expires // interval) * interval
+
+
+def get_signed_urls(filepaths, *, root=None, location='/', max_age=DEFAULT_SECURE_LINK_MAX_AGE,
+                    interval=DEFAULT_SECURE_LINK_INTERVAL, secret=None, now=None) -> dict:
+    """
+    Returns urls for all given files signed for the secure_link module of nginx,
+    so repeated downloads do not have to be handled by django.
+    """
+
+    secret = get_secure_link_secret(secret)
+    expires = get_secure_link_expires(max_age, interval, now=now)
+    response_class = XAccelRedirect.get_subclass('SecureLink', root or settings.BASE_DIR, location)
+    urls = {}
+
+    for filepath in filepaths:
+        uri = response_class.get_url(filepath)
+        query = urlencode({'md5': get_secure_link_hash(uri, expires, secret), 'expires': expires})
+        urls[filepath] = f'{quote(uri)}?{query}'
+
+    return urls
+
+
+def get_signed_url(filepath, **kwargs) -> str:
+    return get_signed_urls([filepath], **kwargs)[filepath]
+
+
+def verify_signed_url(uri, md5, expires, *, secret=None, now=None) -> bool:
+    """
+    Verifies a signed url like nginx does. Meant for tests and development.
+    """
+
+    try:
+        expires = int(expires)
+    except (TypeError, ValueError):
+        return False
+
+    if expires < (now or time.time()):
+        return False
+
+    expected = get_secure_link_hash(uri, expires, get_secure_link_secret(secret))
+
+    # compare_digest only accepts ascii strings, bytes work for any input
+    return hmac.compare_digest(expected.encode('ascii'), f'{md5}'.encode('utf-8', 'surrogateescape'))
+
+
+def serve_signed_file(request, path, *, root=None, location='/'):
+    """
+    Serves the files of signed urls in development, where no nginx verifies them.
+    """
+
+    root = root or settings.BASE_DIR
+    uri = posixpath.join(location, path)
+    filepath = os.path.realpath(os.path.join(root, *path.split(posixpath.sep)))
+
+    if not filepath.startswith(os.path.join(os.path.realpath(root), '')) or not os.path.isfile(filepath):
+        raise Http404('File not found.')
+
+    if not verify_signed_url(uri, request.GET.get('md5'), request.GET.get('expires')):
+        raise Http404('Link expired or invalid.')
+
+    return DjangoFileResponse(filepath, request=request)
@@ -1,16 +1,33 @@
+import io
 import mimetypes
+import multiprocessing
+import os
 import posixpath
+import threading
 
-from functools import lru_cache
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+from itertools import islice
 from urllib.parse import urlsplit, urlparse
 
+from django import setup as django_setup
 from django.conf import settings
 from django.contrib.staticfiles import finders
 from django.contrib.staticfiles.storage import staticfiles_storage
 from django.core.files.storage import default_storage
 from django.template.loader import render_to_string
 
+from .pdfcache import AssetRecorder, get_key, get_version, is_fresh
+
 EMPTY = ''
+DEFAULT_ASSET_STORE_SIZE = 32 * 1024 * 1024
+JOB_FIELDS = (
+    'template',
+    'context',
+    'style',
+    'target',
+)
 
 try:
     from weasyprint import HTML, CSS, default_url_fetcher
@@ -24,6 +41,15 @@ except ImportError:
     # it's okay to not have it in development
     HTML = CSS = default_url_fetcher = None
 
+try:
+    from weasyprint.text.fonts import FontConfiguration
+except ImportError:
+    try:
+        # WeasyPrint < 53
+        from weasyprint.fonts import FontConfiguration
+    except ImportError:
+        FontConfiguration = None
+
 
 def is_local(url):
     parsed = urlparse(url)
@@ -81,30 +107,257 @@ if not settings.DEBUG:
     get_url_description = lru_cache(maxsize=None)(get_url_description)
 
 
+class AssetStore:
+    """
+    Least recently used store for the contents of local assets limited by their total size in bytes.
+    Entries are revalidated against the modification time of their file on every access.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.assets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def open(self, filepath):
+        if not self.max_size:
+            return open(filepath, 'rb')
+
+        version = get_version(filepath)
+
+        with self.lock:
+            cached = self.assets.get(filepath)
+
+            if cached and cached[0] == version:
+                self.assets.move_to_end(filepath)
+                self.hits += 1
+
+                return io.BytesIO(cached[1])
+
+            self.misses += 1
+
+        with open(filepath, 'rb') as fp:
+            content = fp.read()
+
+        self.add(filepath, version, content)
+
+        return io.BytesIO(content)
+
+    def add(self, filepath, version, content):
+        if len(content) > self.max_size:
+            return
+
+        with self.lock:
+            if filepath in self.assets:
+                self.size -= len(self.assets.pop(filepath)[1])
+
+            self.assets[filepath] = version, content
+            self.size += len(content)
+
+            while self.size > self.max_size:
+                _, (_, evicted) = self.assets.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self.lock:
+            self.assets.clear()
+            self.size = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self.assets),
+            'size': self.size,
+            'max_size': self.max_size,
+        }
+
+
+assets = AssetStore(getattr(settings, 'PDF_ASSET_STORE_SIZE', DEFAULT_ASSET_STORE_SIZE))
+
+
 def url_fetcher(url):
     if is_local(url):
         filepath, description = get_url_description(url)
-        file_obj = open(filepath, 'rb')
+        file_obj = assets.open(filepath)
 
         return dict(description, file_obj=file_obj)
 
     return default_url_fetcher(url)
 
 
-def render(template, context, style=None, request=None, target=None, **options):
+class StyleSheetRegistry:
+    """
+    Keeps parsed stylesheets and one font configuration for the whole process,
+    so stylesheets and their font faces are only parsed once per worker.
+    Stylesheets are reparsed when their file or a fetched asset changed if check is enabled.
+
+    Stylesheets are cached per url fetcher. A recording fetcher is unwrapped, the assets fetched
+    while parsing, like fonts, are recorded by the registry and passed on to every recorder asking
+    for the stylesheet, so documents cached by `render` are invalidated when one of them changes.
+    """
+
+    def __init__(self, check=settings.DEBUG):
+        self.check = check
+        self.lock = threading.Lock()
+        self.stylesheets = {}
+        self.font_config = FontConfiguration and FontConfiguration()
+
+    def get(self, filepath, **options):
+        fetcher = options.get('url_fetcher')
+        recorder = fetcher if isinstance(fetcher, AssetRecorder) else None
+        fetcher = recorder.fetcher if recorder else fetcher
+
+        key = filepath, fetcher, options.get('base_url'), options.get('media_type')
+        version = get_version(filepath) if self.check else None
+
+        with self.lock:
+            cached = self.stylesheets.get(key)
+
+            if cached is None or cached[0] != version or (self.check and not is_fresh(cached[2])):
+                cached = self.stylesheets[key] = version, *self.parse(filepath, fetcher, **options)
+
+        if recorder:
+            recorder.assets.update(cached[2])
+
+        return cached[1]
+
+    def parse(self, filepath, fetcher, **options):
+        options = {key: value for key, value in options.items() if key in ('base_url', 'media_type')}
+
+        if self.font_config:
+            options['font_config'] = self.font_config
+
+        if fetcher:
+            options['url_fetcher'] = fetcher = AssetRecorder(fetcher)
+
+        stylesheet = CSS(filename=filepath, **options)
+
+        return stylesheet, fetcher.assets if fetcher else {}
+
+    def clear(self):
+        with self.lock:
+            self.stylesheets.clear()
+
+
+stylesheets = StyleSheetRegistry()
+
+
+def render(template, context, style=None, request=None, target=None, cache=None, **options):
     assert HTML and CSS, 'WeasyPrint is not installed. You cannot use any print features.'
 
     options.setdefault('base_url', settings.BASE_URL)
     options.setdefault('url_fetcher', url_fetcher)
 
-    document = HTML(string=render_to_string(template, context, request=request), **options)
+    string = render_to_string(template, context, request=request)
+    stylesheet = get_filepath(style) if style else None
+
+    if cache is None or target is False:
+        return write(string, stylesheet, target=target, **options)
+
+    key = get_key(string, stylesheet, **options)
+    content = cache.get(key)
+
+    if content is None:
+        options['url_fetcher'] = recorder = AssetRecorder(options['url_fetcher'])
+        content = write(string, stylesheet, **options)
+        cache.set(key, content, recorder.assets)
 
-    if style:
-        stylesheets = [CSS(filename=get_filepath(style), **options)]
+    if target is None:
+        return content
+
+    if hasattr(target, 'write'):
+        target.write(content)
     else:
-        stylesheets = None
+        with open(target, 'wb') as fp:
+            fp.write(content)
+
+
+def write(string, stylesheet=None, target=None, **options):
+    document = HTML(string=string, **options)
+    kwargs = {}
+
+    if stylesheet:
+        kwargs['stylesheets'] = [stylesheets.get(stylesheet, **options)]
+
+    if stylesheets.font_config:
+        kwargs['font_config'] = stylesheets.font_config
 
     if target is False:
-        return document.render(stylesheets=stylesheets)
+        return document.render(**kwargs)
+
+    return document.write_pdf(target=target, **kwargs)
+
+
+def render_many(jobs, workers=None, chunksize=1, mp_context=None, **options):
+    """
+    Renders many documents in a pool of worker processes and yields the results in the order of the jobs.
+    A job is a dict of keyword arguments for `render` or a tuple of template, context, style and target.
+    Jobs with a target yield the target, all others the content of the document. The workers live
+    as long as the pool, so their caches for files and stylesheets stay warm between the jobs.
+
+    Jobs are read lazily and submitted in chunks of chunksize, with at most two chunks per worker in
+    flight, so neither the jobs nor the finished documents pile up in the calling process. Closing
+    the generator cancels the pending chunks and only waits for the ones already running.
+
+    Workers are spawned as fresh processes which set up django on their own, so no database
+    connections get shared with the calling process. Because of that everything passed in the
+    jobs has to be picklable, which rules out passing the request.
+
+    Daemonic processes, like the pool workers of celery, are not allowed to start processes of
+    their own. There a RuntimeError is raised unless workers is 1, which renders in the calling
+    process, so celery tasks have to pass `workers=1` or run in a worker using threads or solo.
+    """
+
+    function = partial(render_job, **options)
+
+    if workers == 1:
+        yield from map(function, jobs)
+        return
+
+    if multiprocessing.current_process().daemon:
+        raise RuntimeError(
+            'render_many could not start worker processes from a daemonic process, '
+            'like a celery prefork worker. Pass workers=1 to render in this process.'
+        )
+
+    workers = workers or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=mp_context or multiprocessing.get_context('spawn'),
+        initializer=django_setup,
+    )
+
+    jobs = iter(jobs)
+    pending = deque()
+
+    try:
+        while chunk := [*islice(jobs, chunksize)]:
+            pending.append(executor.submit(render_chunk, chunk, **options))
+
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+        executor.shutdown(wait=True)
+
+
+def render_chunk(jobs, **options):
+    return [render_job(job, **options) for job in jobs]
+
+
+def render_job(job, **options):
+    if not isinstance(job, dict):
+        job = dict(zip(JOB_FIELDS, job))
+
+    options.update(job)
+    content = render(**options)
 
-    return document.write_pdf(target=target, stylesheets=stylesheets)
+    return content if options.get('target') is None else options['target']
@@ -0,0 +1,202 @@
+"""
+Content addressed cache for rendered PDF documents.
+
+The key is built from the rendered HTML, the stylesheet contents and the render options.
+The modification times of all local assets fetched while rendering are stored alongside
+the document and checked on every lookup, so changed images or fonts invalidate an entry.
+"""
+
+import hashlib
+import os
+import pickle
+import tempfile
+
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from django.core.cache import caches
+
+HASH = hashlib.sha256
+SIMPLE_TYPES = (str, int, float, bool, type(None))
+
+
+def get_key(string, stylesheet=None, **options):
+    """
+    Returns a digest of everything that influences the rendered document besides the fetched assets.
+    """
+
+    digest = HASH(string.encode('utf-8'))
+
+    if stylesheet:
+        with open(stylesheet, 'rb') as fp:
+            digest.update(fp.read())
+
+    for name, value in sorted(options.items()):
+        if isinstance(value, SIMPLE_TYPES):
+            digest.update(f'{name}={value!r}'.encode('utf-8'))
+
+    return digest.hexdigest()
+
+
+def get_version(filepath):
+    try:
+        return os.stat(filepath).st_mtime_ns
+    except (FileNotFoundError, TypeError):
+        return None
+
+
+def is_fresh(assets):
+    return all(get_version(filepath) == version for filepath, version in assets.items())
+
+
+class AssetRecorder:
+    """
+    Wraps an url fetcher and records the versions of all local files it was asked for.
+    """
+
+    def __init__(self, fetcher):
+        self.fetcher = fetcher
+        self.assets = {}
+
+    def __call__(self, url, *args, **kwargs):
+        from .pdf import get_filepath, is_local
+
+        if is_local(url) and (filepath := get_filepath(urlsplit(url).path)):
+            self.assets[filepath] = get_version(filepath)
+
+        return self.fetcher(url, *args, **kwargs)
+
+
+class BasePDFCache:
+    """
+    Counts hits and misses and validates the asset versions of stored documents.
+    Subclasses have to implement `load` and `store`.
+    """
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.load(key)
+
+        if entry is None or not is_fresh(entry['assets']):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+
+        return entry['content']
+
+    def set(self, key, content, assets):
+        if self.max_size is not None and len(content) > self.max_size:
+            return False
+
+        self.store(key, {'content': content, 'assets': assets})
+
+        return True
+
+    def load(self, key):
+        raise NotImplementedError
+
+    def store(self, key, entry):
+        raise NotImplementedError
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+class DjangoPDFCache(BasePDFCache):
+    """
+    Stores documents in one of the configured django caches. Eviction is left to the cache backend,
+    the max size only prevents single documents from being stored that are too large.
+    """
+
+    prefix = 'cosmogo.pdf'
+
+    def __init__(self, alias='default', timeout=None, max_size=None):
+        super(DjangoPDFCache, self).__init__(max_size=max_size)
+
+        self.alias = alias
+        self.timeout = timeout
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def load(self, key):
+        return self.cache.get(f'{self.prefix}:{key}')
+
+    def store(self, key, entry):
+        self.cache.set(f'{self.prefix}:{key}', entry, timeout=self.timeout)
+
+
+class FileSystemPDFCache(BasePDFCache):
+    """
+    Stores documents in a directory and removes the least recently used ones
+    as soon as the total size of the directory exceeds the max size.
+    """
+
+    suffix = '.pdfcache'
+
+    def __init__(self, directory, max_size=None):
+        super(FileSystemPDFCache, self).__init__(max_size=max_size)
+
+        self.directory = Path(directory)
+
+    def get_filepath(self, key):
+        return self.directory / f'{key}{self.suffix}'
+
+    def load(self, key):
+        filepath = self.get_filepath(key)
+
+        try:
+            with open(filepath, 'rb') as fp:
+                entry = pickle.load(fp)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+
+        # mark the entry as recently used for the eviction
+        os.utime(filepath)
+
+        return entry
+
+    def store(self, key, entry):
+        os.makedirs(self.directory, exist_ok=True)
+
+        fd, temporary = tempfile.mkstemp(dir=self.directory)
+
+        with os.fdopen(fd, 'wb') as fp:
+            pickle.dump(entry, fp, protocol=pickle.HIGHEST_PROTOCOL)
+
+        os.replace(temporary, self.get_filepath(key))
+
+        if self.max_size is not None:
+            self.evict(self.max_size)
+
+    def evict(self, max_size):
+        entries = []
+
+        for filepath in self.directory.glob(f'*{self.suffix}'):
+            try:
+                stat = filepath.stat()
+            except FileNotFoundError:
+                continue
+
+            entries.append((stat.st_mtime, stat.st_size, filepath))
+
+        size = sum(size for _, size, _ in entries)
+
+        for _, entry_size, filepath in sorted(entries):
+            if size <= max_size:
+                break
+
+            filepath.unlink(missing_ok=True)
+            size -= entry_size
+
+    def stats(self):
+        stats = super(FileSystemPDFCache, self).stats()
+        stats['size'] = sum(filepath.stat().st_size for filepath in self.directory.glob(f'*{self.suffix}'))
+
+        return stats
@@ -0,0 +1,111 @@
+import os
+import tempfile
+
+from django.conf import settings
+from django.http import FileResponse
+
+from .filepath import is_outdated
+from .http import add_content_disposition_header
+from .nginx import get_response_class
+from .pdf import render
+
+CONTENT_TYPE = 'application/pdf'
+DEFAULT_SPOOL_SIZE = 1024 * 1024
+DEFAULT_LOCATION = '/pdf/'
+DEFAULT_FILE_MODE = 0o644
+DEFAULT_MAX_AGE = 60 * 60
+
+# files describing a document, like the owner of a rendered job, removed together with it
+SIDECAR_SUFFIXES = (
+    '.owner',
+)
+
+
+class PDFResponse(FileResponse):
+    """
+    Renders the document into a spooled temporary file and streams it in chunks,
+    so large documents are kept on disk instead of in memory.
+    """
+
+    def __init__(self, template, context, *, filename=None, as_attachment=True, style=None, request=None,
+                 spool_size=DEFAULT_SPOOL_SIZE, **options):
+        fp = tempfile.SpooledTemporaryFile(max_size=spool_size)
+
+        render(template, context, style=style, request=request, target=fp, **options)
+
+        size = fp.tell()
+        fp.seek(0)
+
+        super(PDFResponse, self).__init__(fp, content_type=CONTENT_TYPE)
+
+        self['Content-Length'] = size
+        add_content_disposition_header(self, filename, as_attachment)
+
+
+def get_pdf_response(template, context, *, filename=None, as_attachment=True, **kwargs):
+    """
+    Returns a response for the rendered document. When PDF_RESPONSE_ROOT is configured the document is
+    written into this directory and handed to nginx, otherwise it is streamed by a PDFResponse.
+    The files are made readable for the nginx workers with PDF_RESPONSE_FILE_MODE. They are not
+    removed after the response, so schedule the `remove-outdated-pdfs` task, which removes documents
+    older than PDF_RESPONSE_MAX_AGE seconds, or call `remove_outdated_documents` periodically.
+    """
+
+    root = getattr(settings, 'PDF_RESPONSE_ROOT', None)
+
+    if settings.DEBUG or not root:
+        return PDFResponse(template, context, filename=filename, as_attachment=as_attachment, **kwargs)
+
+    kwargs.pop('spool_size', None)
+    os.makedirs(root, exist_ok=True)
+    fd, filepath = tempfile.mkstemp(suffix='.pdf', dir=root)
+
+    # temporary files are only readable by their owner, which usually is not the user of nginx
+    os.chmod(filepath, getattr(settings, 'PDF_RESPONSE_FILE_MODE', DEFAULT_FILE_MODE))
+
+    with os.fdopen(fd, 'wb') as fp:
+        render(template, context, target=fp, **kwargs)
+
+    location = getattr(settings, 'PDF_RESPONSE_LOCATION', DEFAULT_LOCATION)
+    response_class = get_response_class('PDF', root, location)
+
+    return response_class(filepath, as_attachment=as_attachment, filename=filename, content_type=CONTENT_TYPE)
+
+
+def remove_outdated_documents(delta=None, root=None):
+    """
+    Removes documents handed to nginx which are older than the given delta,
+    by default PDF_RESPONSE_MAX_AGE seconds. Sidecar files of a document are
+    removed together with it, or on their own once the document is gone.
+    """
+
+    if delta is None:
+        delta = getattr(settings, 'PDF_RESPONSE_MAX_AGE', DEFAULT_MAX_AGE)
+
+    root = root or getattr(settings, 'PDF_RESPONSE_ROOT', None)
+
+    if not (root and os.path.isdir(root)):
+        return 0
+
+    removed = 0
+
+    for entry in os.scandir(root):
+        if not entry.is_file() or not is_outdated(entry.path, delta):
+            continue
+
+        if is_sidecar(entry.path) and os.path.exists(os.path.splitext(entry.path)[0]):
+            continue
+
+        for filepath in [entry.path, *[f'{entry.path}{suffix}' for suffix in SIDECAR_SUFFIXES]]:
+            try:
+                os.remove(filepath)
+            except FileNotFoundError:
+                continue
+
+            removed += 1
+
+    return removed
+
+
+def is_sidecar(filepath):
+    return filepath.endswith(SIDECAR_SUFFIXES)
@@ -1,37 +1,229 @@
 import json
+import mimetypes
+import os
+import pprint
+import threading
+import time
 
 from functools import lru_cache
+from importlib import import_module
 
 from django.conf import settings
 from django.contrib.staticfiles.finders import find as find_static_file
+from django.contrib.staticfiles.storage import staticfiles_storage
 from django.core.exceptions import ImproperlyConfigured, SuspiciousFileOperation
 
+DEFAULT_ASSETS_MAP_PATH = 'assets.map.json'
+DEFAULT_CHECK_INTERVAL = 1 if settings.DEBUG else 10
 
-def get_mapping(path):
+PRELOAD_DESTINATIONS = {
+    '.js': 'script',
+    '.mjs': 'script',
+    '.css': 'style',
+    '.woff': 'font',
+    '.woff2': 'font',
+    '.ttf': 'font',
+    '.otf': 'font',
+}
+
+
+def find_mapping(path):
     """
-    Returns the asset mapping on the given path.
+    Returns the filepath of the asset mapping on the given path.
     """
 
     try:
-        filepath = find_static_file(path) or path
+        return find_static_file(path) or path
     except SuspiciousFileOperation:
         raise ImproperlyConfigured(
             'Your WebPack assets map file is configured with an absolute path. '
             'Please move it into a static directory and use a relative path.'
         )
 
-    try:
-        with open(filepath, 'r') as fp:
-            return json.load(fp)
-    except FileNotFoundError:
-        if settings.DEBUG:
-            raise ImproperlyConfigured(f'{filepath} not found. Please generate assets with WebPack.')
 
-        return {}
+def parse(data):
+    """
+    Returns the asset mapping and the entrypoints of the given assets map. Maps written with entrypoints
+    contain both as objects, while the plain format only contains the mapping of names to strings.
+    """
+
+    if isinstance(data.get('assets'), dict) and isinstance(data.get('entrypoints'), dict):
+        return data['assets'], data['entrypoints']
+
+    return data, {}
+
+
+def get_preload_link(url, asset):
+    _, extension = os.path.splitext(asset)
+    destination = PRELOAD_DESTINATIONS.get(extension)
+
+    if destination is None:
+        mime_type, _ = mimetypes.guess_type(asset)
+        destination = 'image' if mime_type and mime_type.startswith('image/') else 'fetch'
+
+    if destination in ('font', 'fetch'):
+        return f'<{url}>; rel=preload; as={destination}; crossorigin'
+
+    return f'<{url}>; rel=preload; as={destination}'
+
+
+class Manifest:
+    """
+    Holds the asset mapping of a file and reloads it when the modification time or inode of the file
+    changed. The file is checked at most once per interval, so a deployment replacing the file is
+    picked up by running workers without parsing the file on every lookup.
+
+    The version, mapping, entrypoints and preload headers are kept as one state tuple which is replaced
+    as a whole, so readers taking the state once never mix a mapping with the version of another one.
+    """
+
+    def __init__(self, path, interval=DEFAULT_CHECK_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.state = None, {}, {}, {}
+        self.checked = None
+
+    @property
+    def version(self):
+        return self.state[0]
+
+    @property
+    def mapping(self):
+        return self.state[1]
+
+    @property
+    def entrypoints(self):
+        return self.state[2]
+
+    def get_state(self):
+        """
+        Returns the version, mapping, entrypoints and preload headers after checking the file for changes.
+        """
+
+        now = time.monotonic()
+
+        if self.checked is None or now - self.checked >= self.interval:
+            with self.lock:
+                self.reload()
+                self.checked = now
+
+        return self.state
+
+    def get_mapping(self):
+        return self.get_state()[1]
+
+    def reload(self):
+        filepath = find_mapping(self.path)
+
+        try:
+            stat = os.stat(filepath)
+        except FileNotFoundError:
+            if settings.DEBUG:
+                raise ImproperlyConfigured(f'{filepath} not found. Please generate assets with WebPack.')
+
+            self.load({}, None)
+            return
+
+        version = stat.st_mtime_ns, stat.st_ino
+
+        if version != self.version:
+            try:
+                with open(filepath, 'r') as fp:
+                    mapping = json.load(fp)
+            except ValueError:
+                # the file is probably still being written, keep
+                # the current mapping and try again next time
+                return
+
+            self.load(mapping, version)
+
+    def load(self, data, version):
+        mapping, entrypoints = parse(data)
 
+        self.state = version, mapping, entrypoints, {}
+
+    def get(self, name):
+        return self.get_mapping().get(f'{name}')
+
+    def get_entrypoint(self, name):
+        """
+        Returns the asset filenames of all chunks of the given entrypoint.
+        """
+
+        return self.get_state()[2].get(f'{name}') or []
+
+    def get_preload_header(self, name):
+        """
+        Returns the value of a Link header preloading all assets of the given entrypoint.
+        """
+
+        _, _, entrypoints, headers = self.get_state()
+
+        try:
+            return headers[name]
+        except KeyError:
+            assets = entrypoints.get(f'{name}') or []
+            links = [get_preload_link(staticfiles_storage.url(asset), asset) for asset in assets]
+            header = headers[name] = ', '.join(links)
+
+        return header
+
+
+class ModuleManifest(Manifest):
+    """
+    Holds the asset mapping precompiled into a python module by `write_module`.
+    """
+
+    def __init__(self, name):
+        super(ModuleManifest, self).__init__(name, interval=None)
+
+    def get_state(self):
+        if self.checked is None:
+            with self.lock:
+                module = import_module(self.path)
+                data = {'assets': module.MAPPING, 'entrypoints': getattr(module, 'ENTRYPOINTS', {})}
+
+                self.load(data, self.path)
+                self.checked = True
+
+        return self.state
+
+
+def write_module(path, filepath):
+    """
+    Writes the asset mapping on the given path as a python module to the filepath.
+    """
+
+    with open(find_mapping(path), 'r') as fp:
+        mapping, entrypoints = parse(json.load(fp))
+
+    with open(filepath, 'w') as fp:
+        fp.write(f'MAPPING = {pprint.pformat(mapping)}\n')
+        fp.write(f'ENTRYPOINTS = {pprint.pformat(entrypoints)}\n')
+
+
+@lru_cache(maxsize=None)
+def get_manifest(path=None):
+    """
+    Returns the manifest for the given path, defaults to the configured module or path.
+    """
+
+    if path is None and (module := getattr(settings, 'WEBPACK_ASSETS_MAP_MODULE', None)):
+        return ModuleManifest(module)
+
+    path = path or getattr(settings, 'WEBPACK_ASSETS_MAP_PATH', None) or DEFAULT_ASSETS_MAP_PATH
+    interval = getattr(settings, 'WEBPACK_ASSETS_MAP_CHECK_INTERVAL', DEFAULT_CHECK_INTERVAL)
+
+    return Manifest(path, interval=interval)
+
+
+def get_mapping(path):
+    """
+    Returns the asset mapping on the given path.
+    """
 
-if not settings.DEBUG:
-    get_mapping = lru_cache(maxsize=None)(get_mapping)
+    return get_manifest(path).get_mapping()
 
 
 def get_asset(name, path=None):
@@ -39,4 +231,4 @@ def get_asset(name, path=None):
     Returns the asset path for a given asset name.
     """
 
-    return get_mapping(path or getattr(settings, 'WEBPACK_ASSETS_MAP_PATH', None) or 'assets.map.json').get(f'{name}')
+    return get_manifest(path).get(name)
@@ -2,18 +2,34 @@
 Module contains common view mixins.
 """
 
+import hashlib
+import json
 import logging
+import os
+import tempfile
+
+from calendar import timegm
+from collections.abc import Iterator
 
 try:
     from http.client import responses
 except ImportError:
     from httplib import responses
 
+from asgiref.sync import sync_to_async
+
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured, PermissionDenied
-from django.http import Http404, HttpResponse, JsonResponse
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import QuerySet
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.utils.http import http_date, quote_etag
 
 from .encoder import AdvancedJSONEncoder
+from .utils.nginx import get_response_class
 
 
 class APIViewMixIn(object):
@@ -24,6 +40,9 @@ class APIViewMixIn(object):
     DEBUG = settings.DEBUG
     encoder = AdvancedJSONEncoder
     logger = logging.getLogger(__name__)
+    stream_chunk_size = 1000
+    compute_etag = False
+    validators = None, None
 
     @classmethod
     def evaluate(cls, data=None, success=True, message=None, code=None):
@@ -53,6 +72,8 @@ class APIViewMixIn(object):
         Processes the views response and returns a JSON response if possible.
         """
 
+        self.wrap_handler(request)
+
         try:
             response = super(APIViewMixIn, self).dispatch(request, *args, **kwargs)
         except PermissionDenied as error:
@@ -74,7 +95,7 @@ class APIViewMixIn(object):
                 data, success, message, code = self.evaluate(*response)
             elif isinstance(response, dict):
                 data, success, message, code = self.evaluate(data=response)
-            elif isinstance(response, HttpResponse):
+            elif isinstance(response, (HttpResponse, StreamingHttpResponse)):
                 return response
             else:
                 data, success, message, code = self.server_error(
@@ -87,14 +108,146 @@ class APIViewMixIn(object):
     def respond(self, data, success, message, code):
         """
         Returns given data as a JSON response and merges in the success status and the message.
+        Data containing iterators or querysets is streamed and never held in memory as a whole.
         """
 
-        return JsonResponse(
-            data=dict({'success': success, 'message': message}, **data),
+        data = dict({'success': success, 'message': message}, **data)
+
+        if any(map(is_streamable, data.values())):
+            content = self.stream(data)
+
+            if isinstance(getattr(self, 'request', None), ASGIRequest):
+                # django would read a synchronous iterator as a whole under ASGI
+                content = stream_async(content)
+
+            return StreamingHttpResponse(content, content_type='application/json', status=code)
+
+        response = JsonResponse(
+            data=data,
             encoder=self.encoder,
             status=code,
         )
 
+        return self.condition(response)
+
+    def get_etag(self, request, *args, **kwargs):
+        """
+        Could return a version of the data, so unchanged data does not have to be loaded and serialized.
+        """
+
+        return None
+
+    def get_last_modified(self, request, *args, **kwargs):
+        """
+        Could return the last modification of the data as a datetime for the same purpose.
+        """
+
+        return None
+
+    def wrap_handler(self, request):
+        """
+        Checks the validators right before the handler of a GET or HEAD request is called. The
+        permission checks in the dispatch of mixins following this one have passed by then, so
+        no validators are revealed or computed for clients who may not see the data.
+        """
+
+        name = request.method.lower()
+        handler = getattr(self, name, None)
+
+        if name not in ('get', 'head') or handler is None:
+            return
+
+        def conditional(request, *args, **kwargs):
+            return self.get_conditional_response(request, *args, **kwargs) or handler(request, *args, **kwargs)
+
+        setattr(self, name, conditional)
+
+    def get_conditional_response(self, request, *args, **kwargs):
+        """
+        Returns a not modified response before the handler is called when the validators of the view match.
+        Checks made by the handler itself run afterwards, so they have to be repeated in the validator hooks.
+        """
+
+        if request.method not in ('GET', 'HEAD'):
+            return None
+
+        etag = self.get_etag(request, *args, **kwargs)
+        last_modified = self.get_last_modified(request, *args, **kwargs)
+
+        if etag is None and last_modified is None:
+            return None
+
+        etag = etag and quote_etag(f'{etag}')
+        last_modified = last_modified and timegm(last_modified.utctimetuple())
+        self.validators = etag, last_modified
+
+        return self.set_validators(get_conditional_response(request, etag=etag, last_modified=last_modified))
+
+    def condition(self, response):
+        """
+        Adds the validators to a successful response and turns it into a not modified response if they match.
+        Without validators from the view a strong ETag is computed from the content when enabled.
+        """
+
+        request = getattr(self, 'request', None)
+
+        if request is None or request.method not in ('GET', 'HEAD') or response.status_code != 200:
+            return response
+
+        etag, last_modified = self.validators
+
+        if etag is None and self.compute_etag and not response.streaming:
+            etag = quote_etag(hashlib.sha256(response.content).hexdigest())
+            self.validators = etag, last_modified
+
+        self.set_validators(response)
+
+        return get_conditional_response(request, etag=etag, last_modified=last_modified, response=response)
+
+    def set_validators(self, response):
+        etag, last_modified = self.validators
+
+        if response is not None:
+            if etag:
+                response['ETag'] = etag
+
+            if last_modified:
+                response['Last-Modified'] = http_date(last_modified)
+
+        return response
+
+    def stream(self, data):
+        """
+        Encodes the data as a JSON object and yields it in chunks. Iterators and
+        querysets are encoded as arrays whose items are encoded one by one.
+        """
+
+        encoder = self.encoder()
+        encode, separator = encoder.encode, encoder.item_separator
+        chunk = ['{']
+
+        for index, (key, value) in enumerate(data.items()):
+            chunk.append(f'{separator if index else ""}{encode(key)}{encoder.key_separator}')
+
+            if not is_streamable(value):
+                chunk.append(encode(value))
+                continue
+
+            chunk.append('[')
+
+            for position, item in enumerate(iterate(value)):
+                chunk.append(f'{separator if position else ""}{encode(item)}')
+
+                if len(chunk) >= self.stream_chunk_size:
+                    yield ''.join(chunk)
+                    chunk = []
+
+            chunk.append(']')
+
+        chunk.append('}')
+
+        yield ''.join(chunk)
+
     @classmethod
     def server_error(cls, msg, *args, error=None):
         if cls.DEBUG:
@@ -111,4 +264,157 @@ class APIViewMixIn(object):
         return cls.evaluate(success=False, message=f'{error}', code=500)
 
 
+def is_streamable(value):
+    return isinstance(value, (Iterator, QuerySet))
+
+
+def iterate(value):
+    if isinstance(value, QuerySet):
+        return value.iterator()
+
+    return value
+
+
+async def stream_async(iterator):
+    """
+    Yields the chunks of the synchronous iterator one by one. They are built in the thread
+    running the synchronous code of the request, where the queryset iterators are evaluated.
+    """
+
+    get_chunk = sync_to_async(next, thread_sensitive=True)
+
+    try:
+        while (chunk := await get_chunk(iterator, None)) is not None:
+            yield chunk
+    finally:
+        await sync_to_async(iterator.close, thread_sensitive=True)()
+
+
 APIViewMixin = APIViewMixIn
+
+
+class RenderPDFJobMixIn(APIViewMixIn):
+    """
+    A mixin for views that render a PDF in the background.
+
+    A POST queues the job and returns its id, which is derived from the template, the style, the context
+    and the user and signed with the secret key. Identical jobs are queued only once while they are in
+    flight. A GET with the job id returns the state of the job or, when finished, the document itself,
+    but only to the user who queued it. The context has to be serializable by the celery serializer.
+    Finished documents are removed by the `remove-outdated-pdfs` task.
+    """
+
+    pdf_template = None
+    pdf_style = None
+    pdf_filename = None
+    pdf_lock_timeout = 60 * 60
+    job_parameter = 'job'
+
+    def get_pdf_context(self):
+        raise ImproperlyConfigured(f'{self.__class__.__name__} has to implement get_pdf_context.')
+
+    def get_pdf_filename(self):
+        return self.pdf_filename
+
+    def get_pdf_root(self):
+        from .tasks import get_job_root
+
+        return get_job_root()
+
+    def get_pdf_location(self):
+        return getattr(settings, 'PDF_JOB_LOCATION', None) or '/pdf-jobs/'
+
+    def get_owner(self):
+        user = getattr(self.request, 'user', None)
+
+        return f'{getattr(user, "pk", None) or ""}'
+
+    def get_job_id(self, context):
+        content = json.dumps(
+            [self.pdf_template, self.pdf_style, self.get_owner(), context],
+            cls=self.encoder,
+            sort_keys=True,
+        )
+
+        # signed, so ids of other users could not be computed from guessable contexts
+        return salted_hmac('cosmogo.render-pdf', content, algorithm='sha256').hexdigest()
+
+    def get_job_filepath(self, job_id):
+        return os.path.join(self.get_pdf_root(), f'{job_id}.pdf')
+
+    def is_owner(self, job_id):
+        try:
+            with open(f'{self.get_job_filepath(job_id)}.owner') as fp:
+                owner = fp.read()
+        except FileNotFoundError:
+            return False
+
+        return constant_time_compare(owner, self.get_owner())
+
+    def set_owner(self, filepath):
+        """
+        Writes the owner next to the document. The file is replaced as a whole, so concurrent
+        requests for the same job never read it partially written.
+        """
+
+        root = os.path.dirname(filepath)
+        os.makedirs(root, exist_ok=True)
+        fd, temporary = tempfile.mkstemp(suffix='.tmp', dir=root)
+
+        with os.fdopen(fd, 'w') as fp:
+            fp.write(self.get_owner())
+
+        os.replace(temporary, f'{filepath}.owner')
+
+    def post(self, request, *args, **kwargs):
+        from .tasks import RENDER_PDF_LOCK, render_pdf
+
+        context = self.get_pdf_context()
+        job_id = self.get_job_id(context)
+        filepath = self.get_job_filepath(job_id)
+
+        # written before anything is queued, so requests polling for the job always find their owner
+        self.set_owner(filepath)
+
+        if os.path.exists(filepath):
+            return {'job': job_id, 'status': 'SUCCESS'}
+
+        if cache.add(RENDER_PDF_LOCK % job_id, True, timeout=self.pdf_lock_timeout):
+            render_pdf.apply_async(
+                args=(self.pdf_template, context, filepath),
+                kwargs={'style': self.pdf_style},
+                task_id=job_id,
+            )
+
+        return {'job': job_id, 'status': 'PENDING'}, True, None, 202
+
+    def get(self, request, *args, **kwargs):
+        from celery.result import AsyncResult
+
+        job_id = request.GET.get(self.job_parameter) or ''
+
+        if len(job_id) != 64 or not job_id.isalnum() or not self.is_owner(job_id):
+            raise Http404('Unknown job.')
+
+        filepath = self.get_job_filepath(job_id)
+
+        if os.path.exists(filepath):
+            response_class = get_response_class('PDFJob', self.get_pdf_root(), self.get_pdf_location())
+
+            return response_class(
+                filepath,
+                as_attachment=True,
+                filename=self.get_pdf_filename(),
+                content_type='application/pdf',
+                request=request,
+            )
+
+        status = AsyncResult(job_id).state
+
+        if status == 'FAILURE':
+            return {'job': job_id, 'status': status}, False, None, 500
+
+        return {'job': job_id, 'status': status}, True, None, 202
+
+
+RenderPDFJobMixin = RenderPDFJobMixIn